@@ -1,57 +1,348 @@
 import os
-import requests
-import json
+import httpx
+import redis
+import orjson
 import hmac
 import hashlib
+import queue
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
 from datetime import datetime
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 
 load_dotenv()
 
+B2B_EXISTS_TTL = 60
+B2B_PARTICIPANTS_TTL = 30
+CREATE_BATCH_WINDOW = 0.05
+CREATE_BATCH_SIZE = 32
+CREATE_TIMEOUT = 60
+SIGNATURE_CHUNK_SIZE = 8192
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "100"))
+HTTP_TIMEOUT = 10.0
+# httpx применяет таймаут отдельно к каждой фазе запроса (pool, connect, write, read)
+HTTP_REQUEST_MAX_TIME = 4 * HTTP_TIMEOUT
+# Уже отправленная пачка: пакетный запрос и, если он не поддерживается, поштучный
+CREATE_SEND_TIMEOUT = 2 * HTTP_REQUEST_MAX_TIME
+# Блокировка должна пережить самый долгий обработчик: поиск задачи, чтение из Pyrus,
+# ожидание создания и синхронизация участников (два запроса), плюс запас
+CREATE_LOCK_TTL = CREATE_TIMEOUT + CREATE_SEND_TIMEOUT + 4 * HTTP_REQUEST_MAX_TIME + 30
+# На каждый вебхук создания приходится по два параллельных запроса
+EXECUTOR_MAX_WORKERS = 2 * HTTP_POOL_MAXSIZE
+HTTP_KEEPALIVE_EXPIRY = 60.0
+KEEP_WARM_INTERVAL = 30
+KEEP_WARM_TIMEOUT = 2.0
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Удаляет блокировку, только если она всё ещё принадлежит владельцу токена
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+# Заготовки для ответов с фиксированной схемой: сериализуются только переменные части
+PARTICIPANTS_PREFIX = b'{"status":"success","purchase_id":'
+PARTICIPANTS_COUNT = b',"participants_count":'
+PARTICIPANTS_LIST = b',"participants":'
+ALREADY_EXISTS_PREFIX = b'{"status":"already_exists","purchase_id":'
+CREATED_PREFIX = b'{"status":"created","purchase_id":'
+
+# Готовые ответы для частых ошибочных путей: (тело, HTTP-код)
+INVALID_SIG = (b'{"error":"Invalid signature"}', 401)
+IN_PROGRESS = (b'{"status":"in_progress"}', 202)
+NOT_FOUND = ('{"error":"Задача с указанным purchase_id не найдена в Pyrus"}'.encode(), 404)
+
+
+def json_response(obj, status=200):
+    """Сформировать JSON-ответ Flask, сериализованный через orjson."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
+def raw_json_response(body, status=200):
+    """Сформировать JSON-ответ Flask из готовых байтов."""
+    return Response(body, status=status, mimetype="application/json")
+
+
+def purchase_status_response(prefix, purchase_id, status):
+    """Ответ вида {"status": ..., "purchase_id": ...} по заготовленному префиксу."""
+    return raw_json_response(prefix + orjson.dumps(purchase_id) + b'}', status)
+
+
+def participants_response(purchase_id, participants):
+    """Ответ со списком участников закупки."""
+    body = (
+        PARTICIPANTS_PREFIX + orjson.dumps(purchase_id)
+        + PARTICIPANTS_COUNT + str(len(participants)).encode()
+        + PARTICIPANTS_LIST + orjson.dumps(participants) + b'}'
+    )
+    return raw_json_response(body)
+
+
+def keep_warm(bot_ref, closed):
+    """Периодически прогревать соединения бота, пока он жив и не закрыт."""
+    while not closed.wait(KEEP_WARM_INTERVAL):
+        bot = bot_ref()
+        if bot is None:
+            return
+        bot._warm_connections()
+        del bot
+
+
+class PurchaseNotCreated(Exception):
+    """Закупка точно не создана в B2B-Center (отказ B2B или запрос не отправлялся)."""
+
+
+class PurchaseCreateOutcomeUnknown(Exception):
+    """Неизвестно, создана ли закупка в B2B-Center (таймаут, сетевая ошибка, 5xx)."""
+
+
+def create_failure(error):
+    """Новое исключение для одного ожидающего Future по ошибке создания закупки."""
+    if isinstance(error, PurchaseNotCreated):
+        return PurchaseNotCreated(str(error))
+    return PurchaseCreateOutcomeUnknown(f"Результат создания закупки в B2B неизвестен: {error}")
+
+
 class PyrusB2BBot:
     def __init__(self):
         self.pyrus_api_key = os.getenv("PYRUS_API_KEY")
         self.pyrus_form_id = os.getenv("PYRUS_FORM_ID")
+        self.pyrus_purchase_id_field = os.getenv("PYRUS_PURCHASE_ID_FIELD_ID")
         self.pyrus_base_url = os.getenv("PYRUS_BASE_URL")
         self.b2b_url = os.getenv("B2B_CENTER_URL")
         self.b2b_auth = (os.getenv("B2B_CENTER_USERNAME"), os.getenv("B2B_CENTER_PASSWORD"))
+        self._hmac_secret = os.getenv("WEBHOOK_SECRET", "").encode()
         self.pyrus_headers = {
             "Authorization": f"Bearer {self.pyrus_api_key}",
             "Content-Type": "application/json"
         }
+        # Сессии создаются лениво, уже внутри воркера (после fork и monkey-patching gevent)
+        self._pyrus_session = None
+        self._b2b_session = None
+        self._sessions_guard = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS)
+        redis_url = os.getenv("REDIS_URL")
+        self.redis = redis.Redis.from_url(redis_url, decode_responses=True) if redis_url else None
+        self._release_lock_script = self.redis.register_script(RELEASE_LOCK_SCRIPT) if self.redis else None
+        # Без Redis (или при его недоступности) блокировки создания действуют только в пределах процесса
+        self._local_locks = {}
+        self._local_locks_guard = threading.Lock()
+        # Очередь создания закупок: фоновый поток отправляет их в B2B пачками
+        self._create_queue = queue.Queue()
+        self._create_flusher = None
+        self._create_flusher_guard = threading.Lock()
+        self._bulk_create_supported = True
+        self._closed = threading.Event()
+        # Поток прогрева стартует вместе с первой HTTP-сессией, уже внутри воркера
+        self._keep_warm_thread = None
         self.app = Flask(__name__)
         self._setup_routes()
 
-    def _is_signature_correct(self, message, secret, signature):
-        """Проверяет корректность HMAC-подписи (SHA1)."""
-        secret = str.encode(secret)
-        if isinstance(message, str):
-            message = message.encode('utf-8')
-        digest = hmac.new(secret, msg=message, digestmod=hashlib.sha1).hexdigest()
-        return hmac.compare_digest(digest, signature.lower())
+    @staticmethod
+    def _make_session(**kwargs):
+        """Создать HTTP/2-клиент с пулом keep-alive соединений."""
+        return httpx.Client(
+            http2=True,
+            timeout=HTTP_TIMEOUT,
+            # requests следовал редиректам по умолчанию, httpx — нет
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_keepalive_connections=20,
+                max_connections=HTTP_POOL_MAXSIZE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            ),
+            **kwargs
+        )
+
+    @property
+    def pyrus_session(self):
+        """HTTP-сессия Pyrus (создаётся при первом обращении)."""
+        if self._pyrus_session is None:
+            with self._sessions_guard:
+                if self._pyrus_session is None:
+                    self._pyrus_session = self._make_session(headers=self.pyrus_headers)
+                    self._start_keep_warm()
+        return self._pyrus_session
+
+    @property
+    def b2b_session(self):
+        """HTTP-сессия B2B-Center (создаётся при первом обращении)."""
+        if self._b2b_session is None:
+            with self._sessions_guard:
+                if self._b2b_session is None:
+                    self._b2b_session = self._make_session(auth=self.b2b_auth)
+                    self._start_keep_warm()
+        return self._b2b_session
+
+    def close(self):
+        """Закрыть HTTP-сессии и пул потоков (при остановке бота)."""
+        self._closed.set()
+        if self._create_flusher is not None:
+            self._create_queue.put(None)
+        self.executor.shutdown(wait=False)
+        if self._pyrus_session is not None:
+            self._pyrus_session.close()
+        if self._b2b_session is not None:
+            self._b2b_session.close()
+
+    def _start_keep_warm(self):
+        """Запустить поток прогрева соединений (вызывается под _sessions_guard)."""
+        if self._keep_warm_thread is None:
+            # Поток держит только слабую ссылку, чтобы не продлевать жизнь бота
+            self._keep_warm_thread = threading.Thread(
+                target=keep_warm, args=(weakref.ref(self), self._closed), daemon=True
+            )
+            self._keep_warm_thread.start()
+
+    def _warm_connections(self):
+        """Обратиться к Pyrus и B2B-Center, чтобы соединения в пуле не простаивали."""
+        for session, base_url in (
+            (self._pyrus_session, self.pyrus_base_url),
+            (self._b2b_session, self.b2b_url),
+        ):
+            if session is None:
+                continue
+            try:
+                session.head(f"{base_url}/", timeout=KEEP_WARM_TIMEOUT)
+            except Exception:
+                pass
+
+    def _cache_get(self, key):
+        """Прочитать значение из кэша; при недоступности Redis — промах."""
+        if self.redis is None:
+            return None
+        try:
+            return self.redis.get(key)
+        except redis.RedisError:
+            return None
+
+    def _cache_set(self, key, ttl, value):
+        """Записать значение в кэш; ошибки Redis не прерывают обработку."""
+        if self.redis is None:
+            return
+        try:
+            self.redis.setex(key, ttl, value)
+        except redis.RedisError:
+            pass
+
+    def _cache_delete(self, *keys):
+        """Удалить ключи из кэша; ошибки Redis не прерывают обработку."""
+        if self.redis is None:
+            return
+        try:
+            self.redis.delete(*keys)
+        except redis.RedisError:
+            pass
+
+    def _acquire_create_lock(self, purchase_id):
+        """Захватить блокировку создания закупки (только один обработчик на purchase_id).
+
+        Возвращает токен владельца или None, если блокировка уже занята.
+        """
+        token = uuid.uuid4().hex
+        if self.redis is not None:
+            try:
+                acquired = self.redis.set(f"lock:create:{purchase_id}", token, nx=True, ex=CREATE_LOCK_TTL)
+                return token if acquired else None
+            except redis.RedisError:
+                pass
+        with self._local_locks_guard:
+            if purchase_id in self._local_locks:
+                return None
+            self._local_locks[purchase_id] = token
+            return token
+
+    def _release_create_lock(self, purchase_id, token):
+        """Снять блокировку создания закупки, если она принадлежит token."""
+        with self._local_locks_guard:
+            if self._local_locks.get(purchase_id) == token:
+                del self._local_locks[purchase_id]
+                return
+        if self.redis is not None:
+            try:
+                self._release_lock_script(keys=[f"lock:create:{purchase_id}"], args=[token])
+            except redis.RedisError:
+                pass
+
+    def _is_signature_correct(self, stream, signature):
+        """Проверяет корректность HMAC-подписи (SHA1), читая тело запроса по частям."""
+        # Без секрета подпись мог бы сформировать кто угодно — отклоняем все запросы
+        if not self._hmac_secret or not signature:
+            return False
+        try:
+            signature_bytes = bytes.fromhex(signature)
+        except ValueError:
+            return False
+        mac = hmac.new(self._hmac_secret, digestmod=hashlib.sha1)
+        for chunk in iter(lambda: stream.read(SIGNATURE_CHUNK_SIZE), b""):
+            mac.update(chunk)
+        return hmac.compare_digest(mac.digest(), signature_bytes)
 
     def get_pyrus_purchase(self, pyrus_task_id):
         """Получить данные о закупке из Pyrus по ID задачи."""
-        response = requests.get(
-            f"{self.pyrus_base_url}/tasks/{pyrus_task_id}",
-            headers=self.pyrus_headers
+        response = self.pyrus_session.get(
+            f"{self.pyrus_base_url}/tasks/{pyrus_task_id}"
         )
         if response.status_code == 200:
-            return response.json()["task"]
+            return orjson.loads(response.content)["task"]
         else:
             raise Exception(f"Ошибка получения задачи Pyrus: {response.status_code}")
 
+    def _find_task_by_purchase_id(self, purchase_id):
+        """Найти в реестре формы Pyrus задачу с указанным purchase_id.
+
+        Отбор выполняет сам Pyrus (фильтр fld<id> по полю purchase_id),
+        поэтому в ответе приходят только подходящие задачи.
+        """
+        if not self.pyrus_purchase_id_field:
+            raise Exception("Не задан PYRUS_PURCHASE_ID_FIELD_ID для поиска задачи в Pyrus")
+        response = self.pyrus_session.get(
+            f"{self.pyrus_base_url}/forms/{self.pyrus_form_id}/register",
+            params={
+                f"fld{self.pyrus_purchase_id_field}": purchase_id,
+                "field_ids": self.pyrus_purchase_id_field
+            }
+        )
+        if response.status_code != 200:
+            raise Exception(f"Ошибка получения реестра Pyrus: {response.status_code}")
+        tasks = orjson.loads(response.content).get("tasks")
+        return tasks[0]["id"] if tasks else None
+
     def check_purchase_in_b2b(self, purchase_id):
-        """Проверить, существует ли закупка с указанным ID в B2B-Center."""
-        response = requests.get(
-            f"{self.b2b_url}/purchases/{purchase_id}",
-            auth=self.b2b_auth
+        """Проверить, существует ли закупка с указанным ID в B2B-Center.
+
+        Кэшируется только положительный ответ: закупка может появиться в любой
+        момент, а устаревшее "нет" привело бы к созданию дубликата.
+        """
+        return self._is_purchase_cached(purchase_id) or self._fetch_purchase_exists(purchase_id)
+
+    def _is_purchase_cached(self, purchase_id):
+        """Закупка уже известна как существующая (по кэшу)."""
+        return self._cache_get(f"b2b:exists:{purchase_id}") == "1"
+
+    def _fetch_purchase_exists(self, purchase_id):
+        """Запросить существование закупки в B2B-Center в обход кэша."""
+        response = self.b2b_session.get(
+            f"{self.b2b_url}/purchases/{purchase_id}"
         )
-        return response.status_code == 200
+        exists = response.status_code == 200
+        if exists:
+            self._cache_set(f"b2b:exists:{purchase_id}", B2B_EXISTS_TTL, "1")
+        return exists
 
     def create_purchase_in_b2b(self, purchase_data):
-        """Создать закупку в B2B-Center."""
+        """Создать закупку в B2B-Center.
+
+        Запрос ставится в очередь и отправляется вместе с другими закупками,
+        пришедшими в течение CREATE_BATCH_WINDOW секунд. Если B2B-Center не
+        поддерживает пакетное создание, закупка создаётся сразу из текущего потока.
+        """
         payload = {
             "name": purchase_data["subject"],
             "b2b_id": purchase_data.get("b2b_id"),
@@ -60,127 +351,276 @@ class PyrusB2BBot:
             "deadline": purchase_data.get("deadline"),
             "status": "active"
         }
-        response = requests.post(
+        if self._closed.is_set():
+            raise PurchaseNotCreated("Бот остановлен, закупка не отправлена в B2B")
+        if not self._bulk_create_supported:
+            try:
+                return self._post_purchase(payload)
+            except Exception as e:
+                raise create_failure(e) from e
+        future = Future()
+        self._ensure_create_flusher()
+        self._create_queue.put((payload, future))
+        try:
+            return future.result(timeout=CREATE_TIMEOUT)
+        except TimeoutError:
+            # Закупка ещё не отправлена — снимаем её, чтобы она не была создана после ответа 500
+            if future.cancel():
+                raise PurchaseNotCreated("Истекло ожидание отправки закупки в B2B")
+        try:
+            return future.result(timeout=CREATE_SEND_TIMEOUT)
+        except TimeoutError:
+            raise PurchaseCreateOutcomeUnknown("Истекло ожидание ответа B2B на создание закупки")
+
+    def _ensure_create_flusher(self):
+        """Запустить фоновый поток отправки закупок (один на процесс)."""
+        if self._create_flusher is not None:
+            return
+        with self._create_flusher_guard:
+            if self._create_flusher is None:
+                flusher = threading.Thread(target=self._flush_creates, daemon=True)
+                flusher.start()
+                self._create_flusher = flusher
+
+    def _flush_creates(self):
+        """Собирать закупки из очереди и передавать пачки на отправку в пул потоков."""
+        while True:
+            item = self._create_queue.get()
+            if item is None:
+                self._fail_queued_creates()
+                return
+            batch = [item]
+            deadline = time.monotonic() + CREATE_BATCH_WINDOW
+            while len(batch) < CREATE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._create_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._create_queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                self.executor.submit(self._send_create_batch, batch)
+            except RuntimeError:
+                # Пул потоков уже остановлен (close): закупки не отправлялись
+                for _, future in batch:
+                    self._fail_pending_create(future)
+
+    def _fail_queued_creates(self):
+        """Завершить ошибкой закупки, оставшиеся в очереди при остановке бота."""
+        while True:
+            try:
+                item = self._create_queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                self._fail_pending_create(item[1])
+
+    @staticmethod
+    def _fail_pending_create(future):
+        if future.set_running_or_notify_cancel():
+            future.set_exception(PurchaseNotCreated("Бот остановлен, закупка не отправлена в B2B"))
+
+    def _send_create_batch(self, batch):
+        """Отправить пачку закупок и разрешить ожидающие Future."""
+        # Отменённые по таймауту закупки не отправляем; остальные с этого момента не отменить
+        batch = [(payload, future) for payload, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        if len(batch) > 1 and self._bulk_create_supported:
+            try:
+                ids = self._post_purchases_bulk([payload for payload, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(create_failure(e))
+                return
+            if ids is not None:
+                for (_, future), b2b_purchase_id in zip(batch, ids):
+                    future.set_result(b2b_purchase_id)
+                return
+        # Поштучное создание — параллельно и в обход очереди пула: Future уже отмечены как отправленные
+        for payload, future in batch[1:]:
+            threading.Thread(target=self._send_single_create, args=(payload, future), daemon=True).start()
+        self._send_single_create(*batch[0])
+
+    def _send_single_create(self, payload, future):
+        """Создать одну закупку и разрешить её Future."""
+        try:
+            future.set_result(self._post_purchase(payload))
+        except Exception as e:
+            future.set_exception(create_failure(e))
+
+    def _post_purchase(self, payload):
+        """Создать одну закупку в B2B-Center."""
+        response = self.b2b_session.post(
             f"{self.b2b_url}/purchases",
-            json=payload,
-            auth=self.b2b_auth
+            content=orjson.dumps(payload),
+            headers=JSON_HEADERS
         )
         if response.status_code == 201:
-            return response.json()["id"]
-        else:
-            raise Exception(f"Ошибка создания закупки в B2B: {response.status_code}")
+            b2b_purchase_id = orjson.loads(response.content)["id"]
+            self._invalidate_purchase_cache(b2b_purchase_id)
+            return b2b_purchase_id
+        if response.status_code < 500:
+            raise PurchaseNotCreated(f"Ошибка создания закупки в B2B: {response.status_code}")
+        raise PurchaseCreateOutcomeUnknown(f"Ошибка создания закупки в B2B: {response.status_code}")
+
+    def _post_purchases_bulk(self, payloads):
+        """Создать несколько закупок одним запросом.
+
+        Возвращает список ID в порядке payloads или None, если B2B-Center
+        не поддерживает пакетное создание.
+        """
+        response = self.b2b_session.post(
+            f"{self.b2b_url}/purchases/bulk",
+            content=orjson.dumps(payloads),
+            headers=JSON_HEADERS
+        )
+        if response.status_code in (404, 405, 501):
+            self._bulk_create_supported = False
+            return None
+        if response.status_code in (200, 201):
+            ids = [item["id"] for item in orjson.loads(response.content)]
+            if len(ids) != len(payloads):
+                raise PurchaseCreateOutcomeUnknown("Ошибка пакетного создания закупок в B2B: неполный ответ")
+            for b2b_purchase_id in ids:
+                self._invalidate_purchase_cache(b2b_purchase_id)
+            return ids
+        if response.status_code < 500:
+            raise PurchaseNotCreated(f"Ошибка пакетного создания закупок в B2B: {response.status_code}")
+        raise PurchaseCreateOutcomeUnknown(f"Ошибка пакетного создания закупок в B2B: {response.status_code}")
+
+    def _invalidate_purchase_cache(self, b2b_purchase_id):
+        """Сбросить кэш существования и участников закупки."""
+        self._cache_delete(
+            f"b2b:exists:{b2b_purchase_id}",
+            f"b2b:participants:{b2b_purchase_id}"
+        )
 
     def get_b2b_participants(self, purchase_id):
         """Получить список участников (контрагентов) закупки из B2B-Center."""
-        response = requests.get(
-            f"{self.b2b_url}/purchases/{purchase_id}/participants",
-            auth=self.b2b_auth
+        cache_key = f"b2b:participants:{purchase_id}"
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return orjson.loads(cached)
+        response = self.b2b_session.get(
+            f"{self.b2b_url}/purchases/{purchase_id}/participants"
         )
         if response.status_code == 200:
-            return response.json()["participants"]
+            participants = orjson.loads(response.content)["participants"]
+            self._cache_set(cache_key, B2B_PARTICIPANTS_TTL, orjson.dumps(participants))
+            return participants
         else:
             raise Exception(f"Ошибка получения участников: {response.status_code}")
 
     def extract_lots(self, pyrus_purchase):
         """Извлечь данные о лотах из задачи Pyrus."""
-        lots = []
-        for field in pyrus_purchase["fields"]:
-            if "lot" in field["id"]:
-                lot = {
-                    "name": field["value"],
-                    "quantity": field.get("quantity"),
-                    "price": field.get("price")
-                }
-                lots.append(lot)
-        return lots
+        fields = pyrus_purchase.get("fields", ())
+        return [
+            {"name": f["value"], "quantity": f.get("quantity"), "price": f.get("price")}
+            for f in fields if "lot" in f["id"]
+        ]
 
     def extract_documents(self, pyrus_purchase):
         """Извлечь данные о документах из задачи Pyrus."""
-        documents = []
-        for attachment in pyrus_purchase.get("attachments", []):
-            doc = {
-                "name": attachment["name"],
-                "url": attachment["url"],
-                "type": attachment.get("type")
-            }
-            documents.append(doc)
-        return documents
+        attachments = pyrus_purchase.get("attachments", ())
+        return [
+            {"name": a["name"], "url": a["url"], "type": a.get("type")}
+            for a in attachments
+        ]
 
     def extract_participants(self, pyrus_purchase):
         """Извлечь данные об участниках закупки."""
-        participants = []
-        for field in pyrus_purchase["fields"]:
-            if "participant" in field["id"]:
-                participant = {
-                    "inn": field.get("inn"),
-                    "name": field.get("name"),
-                    "status": field.get("status"),  # статус благонадёжности
-                    "documents_url": field.get("documents_url")
-                }
-                participants.append(participant)
-        return participants
+        fields = pyrus_purchase.get("fields", ())
+        return [
+            {
+                "inn": f.get("inn"),
+                "name": f.get("name"),
+                "status": f.get("status"),  # статус благонадёжности
+                "documents_url": f.get("documents_url")
+            }
+            for f in fields if "participant" in f["id"]
+        ]
 
     def sync_participants_to_b2b(self, purchase_id, task_id):
         """Синхронизировать участников закупки в B2B-Center."""
         pyrus_purchase = self.get_pyrus_purchase(task_id)
         participants_data = self.extract_participants(pyrus_purchase)
-        requests.post(
+        self.b2b_session.post(
             f"{self.b2b_url}/purchases/{purchase_id}/participants",
-            json={"participants": participants_data},
-            auth=self.b2b_auth
+            content=orjson.dumps({"participants": participants_data}),
+            headers=JSON_HEADERS
         )
+        self._cache_delete(f"b2b:participants:{purchase_id}")
 
     def _setup_routes(self):
         @self.app.route('/create-b2b/<purchase_id>', methods=['POST'])
         def create_b2b_purchase(purchase_id):
             try:
-                request_body = request.get_data()
                 signature = request.headers.get('X-Pyrus-Signature')
 
-                if not self._is_signature_correct(request_body, os.getenv("WEBHOOK_SECRET"), signature):
-                    return jsonify({"error": "Invalid signature"}), 401
-
-                if self.check_purchase_in_b2b(purchase_id):
-                    return jsonify({
-                        "status": "already_exists",
-                        "purchase_id": purchase_id
-                    }), 200
-
-                task_id = self._find_task_by_purchase_id(purchase_id)
-                if not task_id:
-                    return jsonify({
-                        "error": f"Задача с purchase_id={purchase_id} не найдена в Pyrus"
-                    }), 404
-
-                pyrus_purchase = self.get_pyrus_purchase(task_id)
-                purchase_data = {
-                    "subject": pyrus_purchase["subject"],
-                    "b2b_id": pyrus_purchase.get("b2b_id"),
-                    "lots": self.extract_lots(pyrus_purchase),
-                    "documents": self.extract_documents(pyrus_purchase),
-                    "deadline": pyrus_purchase.get("deadline"),
-                    "participants": self.extract_participants(pyrus_purchase)
-                }
-
-                b2b_purchase_id = self.create_purchase_in_b2b(purchase_data)
-                self.sync_participants_to_b2b(b2b_purchase_id, task_id)
-
-                return jsonify({
-                    "status": "created",
-                    "purchase_id": b2b_purchase_id
-                }), 201
+                if not self._is_signature_correct(request.stream, signature):
+                    return raw_json_response(*INVALID_SIG)
+
+                lock_token = self._acquire_create_lock(purchase_id)
+                if lock_token is None:
+                    return raw_json_response(*IN_PROGRESS)
+                keep_lock = False
+
+                try:
+                    # Повторные доставки отсекаются по кэшу, не запуская запросов к Pyrus
+                    if self._is_purchase_cached(purchase_id):
+                        return purchase_status_response(ALREADY_EXISTS_PREFIX, purchase_id, 200)
+
+                    # Проверка в B2B и поиск задачи в Pyrus независимы — выполняем параллельно
+                    exists_future = self.executor.submit(self._fetch_purchase_exists, purchase_id)
+                    task_future = self.executor.submit(self._find_task_by_purchase_id, purchase_id)
+
+                    if exists_future.result():
+                        task_future.cancel()
+                        return purchase_status_response(ALREADY_EXISTS_PREFIX, purchase_id, 200)
+
+                    task_id = task_future.result()
+                    if not task_id:
+                        return raw_json_response(*NOT_FOUND)
+
+                    pyrus_purchase = self.get_pyrus_purchase(task_id)
+                    purchase_data = {
+                        "subject": pyrus_purchase["subject"],
+                        "b2b_id": pyrus_purchase.get("b2b_id"),
+                        "lots": self.extract_lots(pyrus_purchase),
+                        "documents": self.extract_documents(pyrus_purchase),
+                        "deadline": pyrus_purchase.get("deadline"),
+                        "participants": self.extract_participants(pyrus_purchase)
+                    }
+
+                    try:
+                        b2b_purchase_id = self.create_purchase_in_b2b(purchase_data)
+                    except PurchaseCreateOutcomeUnknown:
+                        # Закупка могла быть создана: не снимаем блокировку, пока не истечёт TTL,
+                        # чтобы повторная доставка не создала дубликат
+                        keep_lock = True
+                        raise
+                    # Отмечаем сразу после создания: повторная доставка вебхука не должна
+                    # создать дубликат, даже если синхронизация участников упадёт
+                    self._cache_set(f"b2b:exists:{purchase_id}", B2B_EXISTS_TTL, "1")
+                    self.sync_participants_to_b2b(b2b_purchase_id, task_id)
+
+                    return purchase_status_response(CREATED_PREFIX, b2b_purchase_id, 201)
+                finally:
+                    if not keep_lock:
+                        self._release_create_lock(purchase_id, lock_token)
             except Exception as e:
-                return jsonify({"error": str(e)}), 500
+                return json_response({"error": str(e)}, 500)
 
         @self.app.route('/load-participants/<purchase_id>', methods=['GET'])
         def load_b2b_participants(purchase_id):
             try:
                 participants = self.get_b2b_participants(purchase_id)
-                return jsonify({
-                    "status": "success",
-                    "purchase_id": purchase_id,
-                    "participants_count": len(participants),
-                    "participants": participants
-                }), 200
+                return participants_response(purchase_id, participants)
             except Exception as e:
-                return jsonify({"error": str(e)}), 500
+                return json_response({"error": str(e)}, 500)
@@ -0,0 +1,15 @@
+"""Точка входа для production WSGI-сервера.
+
+Запуск:
+    HTTP_POOL_MAXSIZE=1000 gunicorn -k gevent -w 4 --worker-connections 1000 wsgi:application
+
+Бот создаётся при импорте модуля в каждом воркере и закрывается через atexit
+при штатном завершении воркера (gunicorn выходит из воркера через sys.exit).
+"""
+import atexit
+
+from bot_pyrus_b2b import PyrusB2BBot
+
+bot = PyrusB2BBot()
+atexit.register(bot.close)
+application = bot.app